@@ -9,8 +9,18 @@ and are only linked against allowed libraries.
 Example usage:
 
     find ../path/to/binaries -type f -executable | xargs python3 contrib/devtools/symbol-check.py
+
+Pass --fast-fail to stop checking an executable after its first failed check.
 '''
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from functools import lru_cache, partial
+import io
+import multiprocessing
+import os
 import sys
+from typing import Optional, Union, cast
 
 import lief
 
@@ -31,7 +41,7 @@ import lief
 #
 # See https://gcc.gnu.org/onlinedocs/libstdc++/manual/abi.html for more info.
 
-MAX_VERSIONS = {
+MAX_VERSIONS: dict[str, Union[tuple[int, ...], dict[lief.ELF.ARCH, tuple[int, ...]]]] = {
 'GCC':       (4,3,0),
 'GLIBC': {
     lief.ELF.ARCH.x86_64: (2,27),
@@ -44,11 +54,25 @@ MAX_VERSIONS = {
 'V':         (0,5,0),  # xkb (bitcoin-qt only)
 }
 
+# MAX_VERSIONS flattened to (lib, arch) -> version, with arch None for
+# libraries that have the same maximum version on every architecture.
+def flatten_max_versions() -> dict[tuple[str, Optional[lief.ELF.ARCH]], tuple[int, ...]]:
+    table: dict[tuple[str, Optional[lief.ELF.ARCH]], tuple[int, ...]] = {}
+    for (lib, max_version) in MAX_VERSIONS.items():
+        if isinstance(max_version, tuple):
+            table[(lib, None)] = max_version
+        else:
+            for (arch, arch_max_version) in max_version.items():
+                table[(lib, arch)] = arch_max_version
+    return table
+
+MAX_VERSION_TABLE = flatten_max_versions()
+
 # Ignore symbols that are exported as part of every executable
-IGNORE_EXPORTS = {
+IGNORE_EXPORTS = frozenset({
 'environ', '_environ', '__environ', '_fini', '_init', 'stdin',
 'stdout', 'stderr',
-}
+})
 
 # Expected linker-loader names can be found here:
 # https://sourceware.org/glibc/wiki/ABIList?action=recall&rev=16
@@ -91,7 +115,7 @@ ELF_ABIS: dict[lief.ELF.ARCH, dict[lief.ENDIANNESS, list[int]]] = {
 }
 
 # Allowed NEEDED libraries
-ELF_ALLOWED_LIBRARIES = {
+ELF_ALLOWED_LIBRARIES = frozenset({
 # bitcoind and bitcoin-qt
 'libgcc_s.so.1', # GCC base support
 'libc.so.6', # C library
@@ -124,9 +148,9 @@ ELF_ALLOWED_LIBRARIES = {
 'libxcb-xfixes.so.0',
 'libxcb-xinerama.so.0',
 'libxcb-xkb.so.1',
-}
+})
 
-MACHO_ALLOWED_LIBRARIES = {
+MACHO_ALLOWED_LIBRARIES = frozenset({
 # bitcoind and bitcoin-qt
 'libc++.1.dylib', # C++ Standard Library
 'libSystem.B.dylib', # libc, libm, libpthread, libinfo
@@ -148,9 +172,9 @@ MACHO_ALLOWED_LIBRARIES = {
 'Metal', # 3D graphics
 'Security', # access control and authentication
 'QuartzCore', # animation
-}
+})
 
-PE_ALLOWED_LIBRARIES = {
+PE_ALLOWED_LIBRARIES = frozenset({
 'ADVAPI32.dll', # security & registry
 'IPHLPAPI.DLL', # IP helper API
 'KERNEL32.dll', # win32 base APIs
@@ -171,42 +195,43 @@ PE_ALLOWED_LIBRARIES = {
 'VERSION.dll', # version checking
 'WINMM.dll', # WinMM audio API
 'WTSAPI32.dll', # Remote Desktop
-}
+})
 
-def check_version(max_versions, version, arch) -> bool:
+@lru_cache(maxsize=None)
+def check_version(version, arch) -> bool:
     (lib, _, ver) = version.rpartition('_')
-    ver = tuple([int(x) for x in ver.split('.')])
-    if not lib in max_versions:
+    ver = tuple(map(int, ver.split('.')))
+    max_version = MAX_VERSION_TABLE.get((lib, arch)) or MAX_VERSION_TABLE.get((lib, None))
+    if max_version is None:
         return False
-    if isinstance(max_versions[lib], tuple):
-        return ver <= max_versions[lib]
-    else:
-        return ver <= max_versions[lib][arch]
+    return ver <= max_version
 
 def check_imported_symbols(binary) -> bool:
     ok: bool = True
+    arch = binary.header.machine_type
 
+    # imported_symbols only yields symbols for which symbol.imported is set.
     for symbol in binary.imported_symbols:
-        if not symbol.imported:
-            continue
-
         version = symbol.symbol_version if symbol.has_version else None
 
         if version:
             aux_version = version.symbol_version_auxiliary.name if version.has_auxiliary_version else None
-            if aux_version and not check_version(MAX_VERSIONS, aux_version, binary.header.machine_type):
-                print(f'{filename}: symbol {symbol.name} from unsupported version {version}')
+            if aux_version and not check_version(aux_version, arch):
+                print(f'{binary.name}: symbol {symbol.name} from unsupported version {version}')
                 ok = False
     return ok
 
 def check_exported_symbols(binary) -> bool:
     ok: bool = True
 
+    if binary.header.machine_type == lief.ELF.ARCH.RISCV:
+        return ok
+
     for symbol in binary.dynamic_symbols:
         if not symbol.exported:
             continue
         name = symbol.name
-        if binary.header.machine_type == lief.ELF.ARCH.RISCV or name in IGNORE_EXPORTS:
+        if name in IGNORE_EXPORTS:
             continue
         print(f'{binary.name}: export of symbol {name} not allowed!')
         ok = False
@@ -216,33 +241,31 @@ def check_ELF_libraries(binary) -> bool:
     ok: bool = True
     for library in binary.libraries:
         if library not in ELF_ALLOWED_LIBRARIES:
-            print(f'{filename}: {library} is not in ALLOWED_LIBRARIES!')
+            print(f'{binary.name}: {library} is not in ALLOWED_LIBRARIES!')
             ok = False
     return ok
 
 def check_MACHO_libraries(binary) -> bool:
     ok: bool = True
     for dylib in binary.libraries:
-        split = dylib.name.split('/')
-        if split[-1] not in MACHO_ALLOWED_LIBRARIES:
-            print(f'{split[-1]} is not in ALLOWED_LIBRARIES!')
+        name = dylib.name.rsplit('/', 1)[-1]
+        if name not in MACHO_ALLOWED_LIBRARIES:
+            print(f'{name} is not in ALLOWED_LIBRARIES!')
             ok = False
     return ok
 
-def check_MACHO_min_os(binary) -> bool:
-    if binary.build_version.minos == [11,0,0]:
-        return True
-    return False
-
-def check_MACHO_sdk(binary) -> bool:
-    if binary.build_version.sdk == [14, 0, 0]:
-        return True
-    return False
-
-def check_MACHO_ld64(binary) -> bool:
-    if binary.build_version.tools[0].version == [711, 0, 0]:
-        return True
-    return False
+def check_MACHO_build_version(binary) -> bool:
+    ok: bool = True
+    build_version = binary.build_version
+    for (field, actual, expected) in [
+        ('min OS', build_version.minos, [11,0,0]),
+        ('SDK', build_version.sdk, [14,0,0]),
+        ('ld64', build_version.tools[0].version, [711,0,0]),
+    ]:
+        if actual != expected:
+            print(f'{binary.name}: {field} version {".".join(map(str, actual))} is not {".".join(map(str, expected))}')
+            ok = False
+    return ok
 
 def check_PE_libraries(binary) -> bool:
     ok: bool = True
@@ -280,9 +303,7 @@ lief.EXE_FORMATS.ELF: [
 ],
 lief.EXE_FORMATS.MACHO: [
     ('DYNAMIC_LIBRARIES', check_MACHO_libraries),
-    ('MIN_OS', check_MACHO_min_os),
-    ('SDK', check_MACHO_sdk),
-    ('LD64', check_MACHO_ld64),
+    ('BUILD_VERSION', check_MACHO_build_version),
 ],
 lief.EXE_FORMATS.PE: [
     ('DYNAMIC_LIBRARIES', check_PE_libraries),
@@ -290,25 +311,74 @@ lief.EXE_FORMATS.PE: [
 ]
 }
 
-if __name__ == '__main__':
-    retval: int = 0
-    for filename in sys.argv[1:]:
+def parse_binary(filename: str):
+    '''
+    Parse an executable, skipping work that none of the checks need.
+    '''
+    if lief.is_macho(filename):
+        # The Mach-O checks only look at load commands, so skip parsing of the
+        # dyld exports, bindings and rebases.
+        # LIEF's stubs declare MachO.parse as returning a Binary, but it
+        # actually returns a FatBinary.
+        fat = cast(Optional[lief.MachO.FatBinary], lief.MachO.parse(filename, lief.MachO.ParserConfig.quick))
+        if fat is None:
+            return None
+        # Like lief.parse, take the last slice of a universal binary.
+        return fat.at(fat.size - 1)
+    return lief.parse(filename)
+
+def check_one(filename: str, fast_fail: bool = False) -> tuple[str, bool]:
+    '''
+    Run all checks on a single executable, or only up to the first failure
+    if fast_fail is set.
+    Returns the report that would have been printed, and whether all checks passed.
+    Parsing happens here, as LIEF binaries cannot be passed between processes.
+    '''
+    out = io.StringIO()
+    ok: bool = True
+    with redirect_stdout(out):
         try:
-            binary = lief.parse(filename)
-            etype = binary.format
-            if etype == lief.EXE_FORMATS.UNKNOWN:
+            # lief.parse returns None both for files it cannot read and for
+            # files in a format it does not recognise, so tell those apart first.
+            if not os.path.isfile(filename) or not os.access(filename, os.R_OK):
+                raise IOError
+            if not (lief.is_elf(filename) or lief.is_pe(filename) or lief.is_macho(filename)):
                 print(f'{filename}: unknown executable format')
-                retval = 1
-                continue
+                return (out.getvalue(), False)
+            binary = parse_binary(filename)
+            if binary is None:
+                raise IOError
+            etype = binary.format
 
             failed: list[str] = []
             for (name, func) in CHECKS[etype]:
                 if not func(binary):
                     failed.append(name)
+                    if fast_fail:
+                        break
             if failed:
                 print(f'{filename}: failed {" ".join(failed)}')
-                retval = 1
+                ok = False
         except IOError:
             print(f'{filename}: cannot open')
-            retval = 1
+            ok = False
+    return (out.getvalue(), ok)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check that release executables only contain allowed symbols and libraries.')
+    parser.add_argument('--fast-fail', action='store_true', help='stop checking an executable after its first failed check')
+    parser.add_argument('executables', nargs='*', help='executables to check')
+    args = parser.parse_args()
+
+    retval: int = 0
+    # Start workers from a clean process rather than forking this one, as
+    # they share no state with the parent. Elsewhere than Linux, use spawn,
+    # which is the platform default on macOS and Windows.
+    mp_context = multiprocessing.get_context('forkserver' if sys.platform.startswith('linux') else 'spawn')
+    # Only the parent process prints, so that reports are not interleaved.
+    with ProcessPoolExecutor(mp_context=mp_context) as executor:
+        for (report, ok) in executor.map(partial(check_one, fast_fail=args.fast_fail), args.executables):
+            print(report, end='')
+            if not ok:
+                retval = 1
     sys.exit(retval)
@@ -11,7 +11,7 @@ import unittest
 
 from utils import determine_wellknown_cmd
 
-def call_symbol_check(cc: list[str], source, executable, options):
+def call_symbol_check(cc: list[str], source, executable, options, check_options: tuple[str, ...] = ()):
     # This should behave the same as AC_TRY_LINK, so arrange well-known flags
     # in the same order as autoconf would.
     #
@@ -22,7 +22,7 @@ def call_symbol_check(cc: list[str], source, executable, options):
         env_flags += filter(None, os.environ.get(var, '').split(' '))
 
     subprocess.run([*cc,source,'-o',executable] + env_flags + options, check=True)
-    p = subprocess.run([os.path.join(os.path.dirname(__file__), 'symbol-check.py'), executable], stdout=subprocess.PIPE, text=True)
+    p = subprocess.run([os.path.join(os.path.dirname(__file__), 'symbol-check.py'), *check_options, executable], stdout=subprocess.PIPE, text=True)
     os.remove(source)
     os.remove(executable)
     return (p.returncode, p.stdout.rstrip())
@@ -88,7 +88,26 @@ class TestSymbolChecks(unittest.TestCase):
 
         self.assertEqual(call_symbol_check(cc, source, executable, ['-lexpat', '-Wl,-platform_version','-Wl,macos', '-Wl,11.4', '-Wl,11.4']),
             (1, 'libexpat.1.dylib is not in ALLOWED_LIBRARIES!\n' +
-                f'{executable}: failed DYNAMIC_LIBRARIES MIN_OS SDK'))
+                f'{executable}: min OS version 11.4.0 is not 11.0.0\n' +
+                f'{executable}: SDK version 11.4.0 is not 14.0.0\n' +
+                f'{executable}: failed DYNAMIC_LIBRARIES BUILD_VERSION'))
+
+        # with --fast-fail, checking stops at the first failure
+        with open(source, 'w', encoding="utf8") as f:
+            f.write('''
+                #include <expat.h>
+
+                int main()
+                {
+                    XML_ExpatVersion();
+                    return 0;
+                }
+
+        ''')
+
+        self.assertEqual(call_symbol_check(cc, source, executable, ['-lexpat', '-Wl,-platform_version','-Wl,macos', '-Wl,11.4', '-Wl,11.4'], ('--fast-fail',)),
+            (1, 'libexpat.1.dylib is not in ALLOWED_LIBRARIES!\n' +
+                f'{executable}: failed DYNAMIC_LIBRARIES'))
 
         source = 'test2.c'
         executable = 'test2'
@@ -104,7 +123,9 @@ class TestSymbolChecks(unittest.TestCase):
         ''')
 
         self.assertEqual(call_symbol_check(cc, source, executable, ['-framework', 'CoreGraphics', '-Wl,-platform_version','-Wl,macos', '-Wl,11.4', '-Wl,11.4']),
-                (1, f'{executable}: failed MIN_OS SDK'))
+                (1, f'{executable}: min OS version 11.4.0 is not 11.0.0\n' +
+                    f'{executable}: SDK version 11.4.0 is not 14.0.0\n' +
+                    f'{executable}: failed BUILD_VERSION'))
 
         source = 'test3.c'
         executable = 'test3'
@@ -117,7 +138,8 @@ class TestSymbolChecks(unittest.TestCase):
         ''')
 
         self.assertEqual(call_symbol_check(cc, source, executable, ['-Wl,-platform_version','-Wl,macos', '-Wl,11.0', '-Wl,11.4']),
-                (1, f'{executable}: failed SDK'))
+                (1, f'{executable}: SDK version 11.4.0 is not 14.0.0\n' +
+                    f'{executable}: failed BUILD_VERSION'))
 
     def test_PE(self):
         source = 'test1.c'